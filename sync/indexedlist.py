@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+import contextlib
+import gzip
+import os
+
+
+class IndexedList():
+    '''write a list of entries, one per line, to a gzipped file
+    as a series of gzip members of ENTRIES_PER_MEMBER lines each, along
+    with a sidecar index of the offset and first entry of each member.
+    concatenated gzip members are still a valid gzip file, so anything
+    that reads these lists via gzip.open or zcat doesn't notice, but
+    we can use the index to skip straight to the right member for an
+    entry (if the list is sorted) or to the last member, instead of
+    decompressing everything before it'''
+    ENTRIES_PER_MEMBER = 1000
+
+    @staticmethod
+    def get_index_path(path):
+        '''return the path to the index file for the given list'''
+        if path.endswith('.gz'):
+            path = path[:-3]
+        return path + '.idx'
+
+    @staticmethod
+    def get_member_offsets(path):
+        '''return a list of (offset, first entry) for each gzip member
+        in the list, or None if the list has no index'''
+        index_path = IndexedList.get_index_path(path)
+        if not os.path.exists(index_path):
+            return None
+        offsets = []
+        with open(index_path, 'rb') as index:
+            for line in index:
+                member_offset, first_entry = line.rstrip(b'\n').split(b' ', 1)
+                offsets.append((int(member_offset), first_entry))
+        return offsets
+
+    @staticmethod
+    @contextlib.contextmanager
+    def open_at(path, offset):
+        '''open a gzipped list for reading, starting at the given offset
+        (which must be the start of a gzip member)'''
+        with open(path, 'rb') as raw:
+            raw.seek(offset)
+            with gzip.GzipFile(fileobj=raw, mode='rb') as infile:
+                yield infile
+
+    @staticmethod
+    def open_near(path, entry):
+        '''open a gzipped sorted list for reading, positioned at the start
+        of the gzip member that would contain the given entry, if there is
+        an index for the list; otherwise positioned at the start of the file'''
+        offset = 0
+        for member_offset, first_entry in IndexedList.get_member_offsets(path) or []:
+            if first_entry > entry:
+                break
+            offset = member_offset
+        return IndexedList.open_at(path, offset)
+
+    @staticmethod
+    def open_last_member(path):
+        '''open a gzipped list for reading, positioned at the start of the
+        last gzip member if there is an index for the list; otherwise
+        positioned at the start of the file'''
+        offsets = IndexedList.get_member_offsets(path)
+        return IndexedList.open_at(path, offsets[-1][0] if offsets else 0)
+
+    def __init__(self, path, mode='wb', compresslevel=9):
+        '''mode may be 'wb' to start a new list or 'ab' to add on to one'''
+        self.output = open(path, mode)
+        self.index = open(self.get_index_path(path), mode)
+        self.compresslevel = compresslevel
+        self.member = None
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, line):
+        '''write one line (entry plus newline) to the list, starting
+        a new gzip member and index entry as needed'''
+        if self.member is None or self.count >= self.ENTRIES_PER_MEMBER:
+            if self.member is not None:
+                self.member.close()
+            self.index.write(b'%d %s\n' % (self.output.tell(), line.rstrip(b'\n')))
+            self.member = gzip.GzipFile(fileobj=self.output, mode='wb',
+                                        compresslevel=self.compresslevel)
+            self.count = 0
+        self.member.write(line)
+        self.count += 1
+
+    def close(self):
+        '''finish up the last gzip member and close everything'''
+        if self.member is not None:
+            self.member.close()
+            self.member = None
+        elif not self.output.tell():
+            # no entries at all; zcat and friends choke on an empty file,
+            # so leave behind a valid gzip stream of nothing instead
+            gzip.GzipFile(fileobj=self.output, mode='wb',
+                          compresslevel=self.compresslevel).close()
+        self.output.close()
+        self.index.close()
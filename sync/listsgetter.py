@@ -1,11 +1,16 @@
 #!/usr/bin/python3
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from sync.webgetter import WebGetter
 
 
 class ListsGetter():
     '''methods to retrieve various lists of media files per project
     from remote location'''
+    # links to dated dirs in the index page of uploaded media lists
+    DATE_LINK = re.compile(rb'<a href="([0-9]{8})/"')
+
     def __init__(self, config, projects, today, verbose=False, dryrun=False):
         '''
         configparser instance,
@@ -18,25 +23,29 @@ class ListsGetter():
         self.today = today
         self.verbose = verbose
         self.dryrun = dryrun
+        # one for everything, so that connections to the server get reused
+        self.getter = WebGetter(self.config, self.dryrun)
+        # date of the latest remote lists, looked up the first time it's needed
+        self.latest_date = None
 
     def get_latest_uploaded_medialists_date(self):
         '''find the most recent date for lists uploaded media per project
-        at the specified url in the config'''
+        at the specified url in the config; the uploaded and foreign repo
+        lists share the date, so we only ask the server once'''
+        if self.latest_date:
+            return self.latest_date
         baseurl = self.config['media_filelists_url']
-        getter = WebGetter(self.config, self.dryrun)
         errors = 'Failed to retrieve list of dates of uploaded media'
-        content = getter.get_content(baseurl, errors)
+        content = self.getter.get_content(baseurl, errors)
         # entries we want:
         # <a href="20190210/">20190210/</a>                                  10-Feb-2019 11:45
-        content = content.decode('utf-8')
-        dates = [line.split('"')[1].rstrip('/') for line in content.splitlines()
-                 if '<a href=' in line]
-        dates = [date for date in dates if date.isdigit() and len(date) == 8]
+        dates = self.DATE_LINK.findall(content)
         if dates:
-            latest = sorted(dates)[-1]
+            self.latest_date = max(dates).decode('utf-8')
             if self.verbose:
-                print("Latest remote media file lists for", baseurl, "have date", latest)
-            return latest
+                print("Latest remote media file lists for", baseurl, "have date",
+                      self.latest_date)
+            return self.latest_date
 
         if self.verbose:
             print("No uploaded media files for", baseurl)
@@ -52,14 +61,22 @@ class ListsGetter():
             return
 
         baseurl = self.config['media_filelists_url'] + '/' + date
-        getter = WebGetter(self.config, self.dryrun)
         todos = self.projects.get_todos()
-        for project in todos:
-            filename = filename_template.format(project=project, date=date)
-            url = baseurl + '/' + filename
-            output_path = os.path.join(self.config['listsdir'],
-                                       self.today, project, filename)
-            getter.get_file(url, output_path, err_message + project)
+        # these are independent, get up to http_workers of them at once
+        with ThreadPoolExecutor(max_workers=max(self.config['http_workers'], 1)) as executor:
+            futures = []
+            for project in todos:
+                filename = filename_template.format(project=project, date=date)
+                url = baseurl + '/' + filename
+                output_path = os.path.join(self.config['listsdir'],
+                                           self.today, project, filename)
+                if not self.dryrun:
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                futures.append(executor.submit(self.getter.get_file, url, output_path,
+                                               err_message + project))
+            for future in futures:
+                # raises if the download failed
+                future.result()
 
     def get_project_uploaded_media(self):
         '''get via http from remote server the latest list
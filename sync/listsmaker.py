@@ -4,6 +4,7 @@ import gzip
 import glob
 import sys
 from subprocess import Popen, PIPE
+from sync.indexedlist import IndexedList
 
 
 class ListsMaker():
@@ -139,7 +140,7 @@ class ListsMaker():
             if self.dryrun:
                 print("would filter {old} to {new}".format(
                     old=most_recent, new=newname))
-                return
+                continue
 
             self.remove_first_line_sort(most_recent, newname)
 
@@ -177,7 +178,7 @@ class ListsMaker():
                 outpath=output_path, localpath=local_files_list, uploadedpath=uploaded_files_list))
         with gzip.open(local_files_list, "rb") as local_files:
             with gzip.open(uploaded_files_list, "rb") as uploaded_files:
-                with gzip.open(output_path, "wb") as output:
+                with IndexedList(output_path) as output:
                     while True:
                         uploaded_line = uploaded_files.readline()
                         if not uploaded_line:
@@ -234,7 +235,7 @@ class ListsMaker():
                 foreignrepopath=foreignrepo_files_list))
         with gzip.open(local_files_list, "rb") as local_files:
             with gzip.open(foreignrepo_files_list, "rb") as foreignrepo_files:
-                with gzip.open(output_path, "wb") as output:
+                with IndexedList(output_path) as output:
                     while True:
                         foreignrepo_line = foreignrepo_files.readline()
                         if not foreignrepo_line:
@@ -309,7 +310,6 @@ class ListsMaker():
                         _unused_output, errors = proc.communicate()
                         if errors:
                             print(errors.decode('utf-8').rstrip('\n'))
-                            return
 
     def list_local_media_not_on_remote(self):
         '''for each project to do, list all media not on the remote
@@ -326,7 +326,7 @@ class ListsMaker():
                 if self.dryrun:
                     print("would write {deletes} from {keeps}, {haves}".format(
                         deletes=deletes_list, keeps=keeps_list, haves=haves_list))
-                    return
+                    continue
                 if self.verbose:
                     print("writing {deletes} from {keeps}, {haves}".format(
                         deletes=deletes_list, keeps=keeps_list, haves=haves_list))
@@ -339,7 +339,7 @@ class ListsMaker():
                                 have_line = haves.readline()
                                 if not have_line:
                                     # done
-                                    return
+                                    break
                                 have = have_line.split()[0]
                                 while (keep is None or keep < have) and not keeps_eof:
                                     keep_line = keeps.readline()
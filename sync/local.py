@@ -1,15 +1,40 @@
 #!/usr/bin/python3
 import os
+import contextlib
 import gzip
+import heapq
+import itertools
+import shlex
 import shutil
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import Popen, PIPE
+try:
+    # much quicker deflate than plain zlib, if available
+    from isal import igzip
+except ImportError:
+    igzip = None
 from sync.listsmaker import ListsMaker
 
 
 class LocalFiles():
     '''methods for setting up local directories, listing local media,
     archiving projects locally, etc'''
+    WRITE_BUFSIZE = 256 * 1024
+    RUN_READSIZE = 64 * 1024
+    # how many hashdirs of one project to walk and stat at once
+    STAT_WORKERS = 8
+    # lines
+    MERGE_BATCHSIZE = 10000
+    # pigz is parallel gzip, use it for compressing and uncompressing lists if we have it
+    GZIP = 'pigz' if shutil.which('pigz') else 'gzip'
+    # local media lists get read a couple of times and then tossed, compress them fast
+    LIST_COMPRESSLEVEL = 1
+
+    # (first level, second level) names of each of the 256 hashdirs
+    HASHDIRS = tuple((first, first + second) for first in '0123456789abcdef'
+                     for second in '0123456789abcdef')
 
     @staticmethod
     def init_hashdirs(basedir, dryrun):
@@ -17,18 +42,34 @@ class LocalFiles():
         create two levels of subdirectories based on how we hash media files
         and store them
         '''
-        # all the hashdirs
-        hexdigits = '0123456789abcdef'
-        hexdigits_split = list(hexdigits)
-        for first_digit in hexdigits_split:
-            for ending in hexdigits_split:
-                subdir = os.path.join(
-                    basedir, first_digit, first_digit + ending)
+        if dryrun:
+            for first, hashdir in LocalFiles.HASHDIRS:
+                subdir = os.path.join(basedir, first, hashdir)
                 if not os.path.exists(subdir):
-                    if dryrun:
-                        print("would make directory(ies):", subdir)
-                    else:
-                        os.makedirs(subdir)
+                    print("would make directory(ies):", subdir)
+            return
+
+        # make each first level dir (and any missing parents) just once,
+        # then the hashdirs underneath it with a single mkdir each; where we
+        # can, those are relative to the open first level dir, so the kernel
+        # doesn't have to look up the whole path every time
+        use_dir_fd = os.mkdir in os.supports_dir_fd
+        for first, hashdirs in itertools.groupby(LocalFiles.HASHDIRS, key=lambda pair: pair[0]):
+            firstdir = os.path.join(basedir, first)
+            os.makedirs(firstdir, exist_ok=True)
+            firstdir_fd = os.open(firstdir, os.O_RDONLY) if use_dir_fd else None
+            try:
+                for _first, hashdir in hashdirs:
+                    try:
+                        if firstdir_fd is None:
+                            os.mkdir(os.path.join(firstdir, hashdir))
+                        else:
+                            os.mkdir(hashdir, dir_fd=firstdir_fd)
+                    except FileExistsError:
+                        pass
+            finally:
+                if firstdir_fd is not None:
+                    os.close(firstdir_fd)
 
     def __init__(self, config, projects, today, most_recent_lists,
                  full=False, verbose=False, dryrun=False):
@@ -43,6 +84,8 @@ class LocalFiles():
         self.full = full
         self.verbose = verbose
         self.dryrun = dryrun
+        # how many projects' media lists to generate or sort at once
+        self.workers = max(self.config.get('local_workers', 1), 1)
 
     def init_mediadirs(self):
         '''if there is no local basedir for media, or if
@@ -66,14 +109,31 @@ class LocalFiles():
         return'''
         self.projects.fill_in_projecttypes()
         for project in self.get_projects():
-            if project not in self.projects.active and not self.project_is_empty(project):
+            if project in self.projects.active:
+                continue
+            if self.project_is_empty(project):
+                self.remove_empty_project(project)
+            else:
                 self.archive_project(project)
 
+    def remove_empty_project(self, project):
+        '''remove the local directory tree of a project with nothing but
+        directories in it; only directories get removed, so if something else
+        turns up in there meanwhile, we complain and leave it for next time'''
+        project_dir = self.get_project_dir(project)
+        if self.dryrun:
+            print("would remove empty directory tree", project_dir)
+            return
+        try:
+            for dirpath, _dirnames, _filenames in os.walk(project_dir, topdown=False):
+                os.rmdir(dirpath)
+        except OSError as ex:
+            print("failed to remove empty project directory", project_dir, ex)
+
     def archive_project(self, project):
         '''move the project subdir into the archive area,
         adding the current date and time onto the langcode name'''
-        if not os.path.exists(self.config['archivedir']):
-            os.makedirs(self.config['archivedir'])
+        os.makedirs(self.config['archivedir'], exist_ok=True)
 
         projecttype, langcode = self.projects.get_projecttype_langcode(project)
         now = time.strftime("%Y%m%d%H%M%S", time.gmtime())
@@ -91,10 +151,6 @@ class LocalFiles():
             shutil.move(os.path.join(self.config['mediadir'], projecttype, langcode),
                         os.path.join(self.config['archivedir'], projecttype, newname))
 
-    def dir_is_empty(self, dirname):
-        '''return True if directory has no contents'''
-        return not bool(len(os.listdir(os.path.join(self.config['mediadir'], dirname))))
-
     def get_projects(self):
         '''return list of locally synced projects'''
         projects = []
@@ -106,6 +162,12 @@ class LocalFiles():
                     projecttype, langcode))
         return projects
 
+    def get_local_todos(self):
+        '''return list of projects to do that have a local media directory;
+        cheaper than listing out all the local projects and filtering'''
+        return [project for project in self.projects.get_todos()
+                if os.path.isdir(self.get_project_dir(project))]
+
     def get_project_dir(self, project):
         '''given a project name which is either a dbname (and findable in
         active.projects) or a string of the format projecttype/langcode, return
@@ -115,27 +177,33 @@ class LocalFiles():
         return os.path.join(self.config['mediadir'], projecttype, langcode)
 
     def project_is_empty(self, project):
-        '''return True if the specified project has no media
-        stored locally'''
-        project_dir = self.get_project_dir(project)
-        hexdigits = '0123456789abcdef'
-        hexdigits_split = list(hexdigits)
-        for first_digit in hexdigits_split:
-            for ending in hexdigits_split:
-                subdir = os.path.join(project_dir, first_digit, first_digit + ending)
-                if os.path.exists(subdir):
-                    if not self.dir_is_empty(subdir):
-                        return False
+        '''return True if the specified project has nothing stored locally
+        but directories, so that the whole tree can be removed; anything
+        else at all, media or not, and it gets archived instead'''
+        dirs = [self.get_project_dir(project)]
+        while dirs:
+            try:
+                with os.scandir(dirs.pop()) as entries:
+                    for entry in entries:
+                        if not entry.is_dir(follow_symlinks=False):
+                            return False
+                        dirs.append(entry.path)
+            except FileNotFoundError:
+                continue
         return True
 
-    def iterate_local_mediafiles_for_project(self, project):
-        '''return an iterator which will return the full path of each local media file
-        for the specified project, in turn'''
-        (projecttype, langcode) = self.projects.get_projecttype_langcode(project)
-        basedir = os.path.join(self.config['mediadir'], projecttype, langcode)
-        for dirpath, _dirnames, filenames in os.walk(basedir):
-            for mediafile in filenames:
-                yield os.path.join(dirpath, mediafile)
+    @staticmethod
+    def iterate_files_under(path):
+        '''return an iterator which will return a DirEntry for each file
+        under the given directory, at any depth. scandir knows from the
+        directory listing which entries are files and which are dirs, so
+        unlike os.walk there's no stat needed to find out'''
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from LocalFiles.iterate_files_under(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
 
     def sort_local_media_for_project(self, project, date=None):
         '''read a list of all media for a local active project,
@@ -157,17 +225,33 @@ class LocalFiles():
         if not os.path.exists(inputpath):
             if self.dryrun or self.verbose:
                 print("no file {infile} to sort, skipping".format(infile=inputpath))
-                return
+            return
 
-        command = "zcat {infile} | LC_ALL=C sort -k 1 -S 70% | gzip > {outfile}".format(
-            infile=inputpath, outfile=outputpath)
+        if os.path.exists(self.get_runs_index_path(inputpath)):
+            if self.dryrun:
+                print("for project", project, "would merge sorted runs of media into",
+                      outputpath)
+            else:
+                self.merge_local_media_runs(inputpath, outputpath)
+            return
+
+        # lists from before we wrote them out as sorted runs need a full sort.
+        # several of these may be running at once, they have to share memory and cpus
+        command = ("{gzip} -dc {infile} | sort --parallel={cpus} -k 1 -S {mem}% | "
+                   "{gzip} -{level} > {outfile}").format(
+                       gzip=self.GZIP, infile=shlex.quote(inputpath),
+                       cpus=max((os.cpu_count() or 1) // self.workers, 1),
+                       mem=max(70 // self.workers, 1), level=self.LIST_COMPRESSLEVEL,
+                       outfile=shlex.quote(outputpath))
         if self.dryrun:
             print("for project", project, "would sort media into", outputpath, 'with command:')
             print(command)
         else:
             # these lists can be huge so let's not fool ourselves into thinking
             # we're going to do it all in memory.
-            with Popen(command, shell=True, stderr=PIPE) as proc:
+            # byte order comparisons, much faster than locale-aware collation
+            with Popen(command, shell=True, stderr=PIPE,
+                       env=dict(os.environ, LC_ALL='C')) as proc:
                 _unused_output, errors = proc.communicate()
                 if errors:
                     print(errors.decode('utf-8').rstrip('\n'))
@@ -185,39 +269,191 @@ class LocalFiles():
         if not date:
             date = self.today
         basedir = os.path.join(self.config['listsdir'], date, project)
-        if not os.path.exists(basedir):
-            os.makedirs(basedir)
+        # other projects may be making the same parent dirs at the same time
+        os.makedirs(basedir, exist_ok=True)
         # if it's already there, what does that mean for us? we'll overwrite the
         # existing list. too bad. maybe we're redoing a bad run or something.
         outputpath = os.path.join(basedir, project + '-local-media.gz')
         if self.dryrun:
             print("for project", project, "would log media into", outputpath)
         else:
-            with gzip.open(outputpath, "wb") as output:
-                for path in self.iterate_local_mediafiles_for_project(project):
-                    dirname, filename = os.path.split(path)
-                    # yep we get to stat them all. groan
-                    mtime = os.stat(path).st_mtime
-                    timestamp = time.strftime("%Y%m%d%H%M%S", time.gmtime(mtime))
-                    output.write('{filename} {timestamp} {dirname}\n'.format(
-                        filename=filename, timestamp=timestamp, dirname=dirname).encode('utf-8'))
+            self.write_local_media_runs(project, outputpath)
+
+    @staticmethod
+    def gzip_writer(fileobj):
+        '''return a gzip file object for writing a list to the given
+        open file, using isal if we have it'''
+        if igzip is not None:
+            return igzip.open(fileobj, "wb", compresslevel=LocalFiles.LIST_COMPRESSLEVEL)
+        return gzip.GzipFile(fileobj=fileobj, mode="wb",
+                             compresslevel=LocalFiles.LIST_COMPRESSLEVEL)
+
+    @contextlib.contextmanager
+    def open_list_output(self, outputpath):
+        '''open a gzipped list for writing, leaving the compression to pigz
+        if we have it so that it happens in parallel with whatever is producing
+        the entries'''
+        with open(outputpath, "wb", buffering=self.WRITE_BUFSIZE) as rawout:
+            if self.GZIP == 'gzip':
+                with self.gzip_writer(rawout) as output:
+                    yield output
+                return
+            command = [self.GZIP, '-{level}'.format(level=self.LIST_COMPRESSLEVEL)]
+            with Popen(command, stdin=PIPE, stdout=rawout, stderr=PIPE,
+                       bufsize=self.WRITE_BUFSIZE) as proc:
+                yield proc.stdin
+                proc.stdin.close()
+                errors = proc.stderr.read()
+                if errors:
+                    print(errors.decode('utf-8').rstrip('\n'))
+
+    @staticmethod
+    def get_runs_index_path(path):
+        '''return the path to the file of sorted run offsets for the given list'''
+        if path.endswith('.gz'):
+            path = path[:-3]
+        return path + '.runs'
+
+    @staticmethod
+    def get_runs_layout(project_dir):
+        '''return a list of the second level directories under the given
+        project dir (normally just the hashdirs) and a list of DirEntry for
+        any files above that level, so that between them they cover every
+        file in the project; paths are bytes'''
+        dirs = [os.fsencode(project_dir)]
+        files = []
+        for _level in range(2):
+            subdirs = []
+            for dirpath in dirs:
+                try:
+                    with os.scandir(dirpath) as entries:
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                files.append(entry)
+                except FileNotFoundError:
+                    pass
+            dirs = subdirs
+        return dirs, files
+
+    def write_local_media_runs(self, project, outputpath):
+        '''write the list of all media for a local project to the given path,
+        walking the tree and statting everything ourselves.
+        each hashdir holds only a small slice of a project's media, so we sort
+        its entries in memory and write them out as a separate gzip member;
+        anything outside of the hashdirs goes in a run of its own.
+        the offsets of the members go in a sidecar file, and sorting the list
+        is then just a merge of these runs, no big external sort needed'''
+        subdirs, files = self.get_runs_layout(self.get_project_dir(project))
+        offsets = []
+        # lots of media shares the same upload day, so format each day
+        # just once and tack the time of day onto it
+        days = {}
+        with open(outputpath, "wb", buffering=self.WRITE_BUFSIZE) as output:
+            if files:
+                offsets.append(output.tell())
+                with self.gzip_writer(output) as member:
+                    member.write(b''.join(sorted(
+                        self.get_media_entry(entry, days) for entry in files)))
+            # stat waits on the filesystem and lets go of the GIL meanwhile, so walk
+            # several hashdirs at once; a batch at a time, so that one slow hashdir
+            # can't leave all the rest of the project piled up in memory
+            with ThreadPoolExecutor(max_workers=self.STAT_WORKERS) as executor:
+                for batch_start in range(0, len(subdirs), self.STAT_WORKERS * 2):
+                    batch = subdirs[batch_start:batch_start + self.STAT_WORKERS * 2]
+                    for entries in executor.map(self.get_sorted_local_media_entries, batch,
+                                                itertools.repeat(days)):
+                        if not entries:
+                            continue
+                        offsets.append(output.tell())
+                        with self.gzip_writer(output) as member:
+                            member.write(b''.join(entries))
+            offsets.append(output.tell())
+        with open(self.get_runs_index_path(outputpath), "w") as index:
+            index.write(''.join('{offset}\n'.format(offset=offset) for offset in offsets))
+
+    @staticmethod
+    def get_sorted_local_media_entries(dirpath, days):
+        '''return a sorted list of entries (bytes) for all media files
+        under the given directory, if it exists'''
+        if not os.path.isdir(dirpath):
+            return []
+        return sorted(LocalFiles.get_local_media_entries(dirpath, days))
+
+    @staticmethod
+    def get_local_media_entries(dirpath, days):
+        '''return an iterator which will return a list entry (bytes) for each
+        media file under the given directory, using and filling in the dict
+        of day numbers to formatted dates'''
+        # walking with a bytes path gets us bytes names and paths, which go
+        # straight into the entries, no decoding and encoding them again
+        for entry in LocalFiles.iterate_files_under(os.fsencode(dirpath)):
+            yield LocalFiles.get_media_entry(entry, days)
+
+    @staticmethod
+    def get_media_entry(entry, days):
+        '''return the list entry (bytes) for the media file with the given
+        DirEntry (bytes path), using and filling in the dict of day numbers
+        to formatted dates'''
+        dirname, filename = os.path.split(entry.path)
+        # yep we get to stat them all. groan
+        mtime = entry.stat(follow_symlinks=False).st_mtime
+        day, seconds = divmod(int(mtime // 1), 86400)
+        if day not in days:
+            days[day] = time.strftime("%Y%m%d", time.gmtime(day * 86400)).encode('ascii')
+        hours, seconds = divmod(seconds, 3600)
+        return b'%s %s%02d%02d%02d %s\n' % (filename, days[day], hours, seconds // 60,
+                                             seconds % 60, dirname)
+
+    @staticmethod
+    def read_run(fdesc, start, end):
+        '''return an iterator over the lines of the gzip member between the
+        given offsets of an open file; reading with pread means any number
+        of these can share the one file descriptor'''
+        decompressor = zlib.decompressobj(wbits=31)
+        partial = b''
+        while start < end:
+            data = os.pread(fdesc, min(LocalFiles.RUN_READSIZE, end - start), start)
+            if not data:
+                break
+            start += len(data)
+            lines = (partial + decompressor.decompress(data)).split(b'\n')
+            partial = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+
+    def merge_local_media_runs(self, inputpath, outputpath):
+        '''merge the sorted runs of the given list of local media into
+        one sorted list at the output path'''
+        with open(self.get_runs_index_path(inputpath), "r") as index:
+            offsets = [int(line) for line in index]
+        with open(inputpath, "rb", buffering=0) as infile:
+            runs = [self.read_run(infile.fileno(), start, end)
+                    for start, end in zip(offsets, offsets[1:])]
+            merged = heapq.merge(*runs)
+            with self.open_list_output(outputpath) as output:
+                while True:
+                    entries = b''.join(itertools.islice(merged, self.MERGE_BATCHSIZE))
+                    if not entries:
+                        break
+                    output.write(entries)
+
+    def do_for_projects(self, method, projects):
+        '''call the given method for each project in the list,
+        doing up to local_workers projects at once'''
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # list() so that any exceptions get raised here
+            list(executor.map(method, projects))
 
     def get_local_media_lists(self):
         '''write a list of all media for each local project in the todo list'''
-        if not os.path.exists(self.config['listsdir']):
-            os.makedirs(self.config['listsdir'])
-        local_projects = self.get_projects()
-        todo = self.projects.get_todos()
-        for project in local_projects:
-            if project in todo:
-                if self.full or not ListsMaker.get_most_recent_file(
-                        project, '-all-media-keep.gz', self.most_recent_lists):
-                    self.record_local_media_for_project(project)
+        os.makedirs(self.config['listsdir'], exist_ok=True)
+        projects = [project for project in self.get_local_todos() if (
+            self.full or not ListsMaker.get_most_recent_file(
+                project, '-all-media-keep.gz', self.most_recent_lists))]
+        self.do_for_projects(self.record_local_media_for_project, projects)
 
     def sort_local_media_lists(self):
         '''read and sort the local media lists'''
-        local_projects = self.get_projects()
-        todo = self.projects.get_todos()
-        for project in local_projects:
-            if project in todo:
-                self.sort_local_media_for_project(project)
+        self.do_for_projects(self.sort_local_media_for_project, self.get_local_todos())
@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+import queue
+import threading
+
+
+class LogWriter():
+    '''write entries to an open file handle from a separate thread,
+    so that whoever is producing them (the download loop, for example)
+    doesn't have to wait around while they are compressed and written'''
+    def __init__(self, fhandle):
+        self.fhandle = fhandle
+        self.entries = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.write_entries, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish()
+        # if we're already on our way out with an exception, that's the
+        # one the caller needs to see, not some write error it led to
+        if exc_type is None and self.error is not None:
+            raise self.error
+
+    def write_entries(self):
+        '''write queued entries until we get None, holding on to
+        the first error, if any, for close() to raise'''
+        while True:
+            entry = self.entries.get()
+            if entry is None:
+                return
+            if self.error is None:
+                try:
+                    self.fhandle.write(entry)
+                except Exception as ex:
+                    self.error = ex
+
+    def write(self, entry):
+        '''queue an entry for writing'''
+        self.entries.put(entry)
+
+    def finish(self):
+        '''wait for all queued entries to be written'''
+        self.entries.put(None)
+        self.thread.join()
+
+    def close(self):
+        '''wait for all queued entries to be written, raising the first
+        write error if there was one; the file handle is left open for
+        the caller to deal with'''
+        self.finish()
+        if self.error is not None:
+            raise self.error
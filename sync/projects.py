@@ -1,13 +1,21 @@
 #!/usr/bin/python3
-import json
+import hashlib
+import os
 import time
 import requests
+try:
+    # quicker parsing of the (big) site matrix, if available
+    import orjson as json
+except ImportError:
+    import json
 from sync.webgetter import WebGetter
 
 
 class Projects():
     '''keeping track of and manipulating the list of projects
     active on the remote end, the list of projects to do, etc.'''
+    # how long a saved copy of the site matrix is good for, in seconds
+    SITEMATRIX_MAXAGE = 86400
 
     @staticmethod
     def is_active(project):
@@ -24,8 +32,7 @@ class Projects():
         For Wikimedia project mirroring, the foreign repo
         would be commons.wikimedia.org (commonswiki).'''
         if config['foreignrepo']:
-            if config['foreignrepo'] in active_projects:
-                active_projects.pop(config['foreignrepo'], None)
+            active_projects.pop(config['foreignrepo'], None)
 
     @staticmethod
     def get_projecttype_from_url(url):
@@ -34,16 +41,26 @@ class Projects():
         # https://si.wikipedia.org
         return url.rsplit('.', 2)[1]
 
-    def __init__(self, config, projects_todo, dryrun):
+    def __init__(self, config, projects_todo, dryrun, refresh_sitematrix=False):
         '''
         args: config
               dict of active projects
               list of projects to do
+              whether to ignore any saved copy of the site matrix
         '''
         self.config = config
         self.dryrun = dryrun
+        self.refresh_sitematrix = refresh_sitematrix
+        self.siteinfo = None
+        # one of each for all our api requests, so that connections get reused
+        self.getter = WebGetter(self.config, dryrun=self.dryrun)
+        self.api_session = requests.Session()
+        self.api_session.headers.update(
+            {"User-Agent": self.config['agent'], "Accept": "application/json"})
+        self.getter.mount_adapter(self.api_session)
         self.active = self.get_active_projects(projects_todo)
         self.exclude_foreign_repo(config, self.active)
+        self.projecttypes_langcodes_cache = {}
         self.projecttypes_langcodes_to_dbnames = self.get_active_projects_by_projecttype_langcode()
 
     def get_projecttype_from_api(self, url, getter, session, project):
@@ -71,26 +88,45 @@ class Projects():
             pass
         return None
 
+    def get_sitematrix_cache_path(self):
+        '''return the path to the saved copy of the site matrix for the api url'''
+        url_hash = hashlib.sha1(self.config['api_url'].encode('utf-8')).hexdigest()
+        return os.path.join(self.config['listsdir'], 'sitematrix-' + url_hash + '.json')
+
     def get_siteinfo(self):
-        '''get site info from MediaWiki via the api'''
+        '''get site info from MediaWiki via the api, or from the copy we saved
+        last time if it's recent enough; it hardly ever changes, and it's big'''
+        if self.siteinfo is not None:
+            return self.siteinfo
+        cache_path = self.get_sitematrix_cache_path()
+        if not self.refresh_sitematrix:
+            try:
+                if time.time() - os.path.getmtime(cache_path) < self.SITEMATRIX_MAXAGE:
+                    with open(cache_path, 'rb') as cached:
+                        self.siteinfo = json.loads(cached.read())
+                    return self.siteinfo
+            except (OSError, ValueError):
+                # missing or garbled, get a fresh one
+                pass
+
         baseurl = (self.config['api_url'])
-        params = {'action': 'sitematrix', 'format': 'json'}
-        sess = requests.Session()
-        sess.headers.update(
-            {"User-Agent": self.config['agent'], "Accept": "application/json"})
-        getter = WebGetter(self.config, dryrun=self.dryrun)
+        # let the caches in front of the api hand us a copy too
+        params = {'action': 'sitematrix', 'format': 'json',
+                  'maxage': self.SITEMATRIX_MAXAGE, 'smaxage': self.SITEMATRIX_MAXAGE}
         errors = 'Failed to retrieve list of active projects'
-        content = getter.get_content(baseurl, errors, session=sess, params=params)
-        return json.loads(content)
+        content = self.getter.get_content(baseurl, errors, session=self.api_session,
+                                          params=params)
+        self.siteinfo = json.loads(content)
+        if not self.dryrun:
+            # write and rename so nobody ever sees a partial copy
+            with open(cache_path + '.tmp', 'wb') as output:
+                output.write(content)
+            os.replace(cache_path + '.tmp', cache_path)
+        return self.siteinfo
 
     def process_special_sites(self, specials, active_projects, todo):
         '''turn the 'specials' section of the site matrix info into
         project info'''
-        sess = requests.Session()
-        sess.headers.update(
-            {"User-Agent": self.config['agent'], "Accept": "application/json"})
-        getter = WebGetter(self.config, dryrun=self.dryrun)
-
         for site in specials:
             if 'private' in site:
                 continue
@@ -102,7 +138,7 @@ class Projects():
                 continue
 
             active_projects[site['dbname']]['projecttype'] = self.get_projecttype_from_api(
-                site['url'], getter, sess, site['dbname'])
+                site['url'], self.getter, self.api_session, site['dbname'])
             # this is us being nice to the remote servers
             time.sleep(self.config['http_wait'])
 
@@ -121,13 +157,13 @@ class Projects():
                 #   'code': 'wikibooks', 'sitename': 'Wikibooks', 'closed': ''},
                 #  {'url': 'https://tk.wikiquote.org', 'dbname': 'tkwikiquote',
                 #   'code': 'wikiquote', 'sitename': 'Wikiquote', 'closed': ''}]
+                langcode = regular_site['code']
                 for site in regular_site['site']:
-                    active_projects[site['dbname']] = {
-                        'projecttype': self.get_projecttype_from_url(site['url']),
-                        'langcode': regular_site['code']}
-
+                    project = {'projecttype': self.get_projecttype_from_url(site['url']),
+                               'langcode': langcode}
                     if not todo or site['dbname'] in todo:
-                        active_projects[site['dbname']]['todo'] = True
+                        project['todo'] = True
+                    active_projects[site['dbname']] = project
         except TypeError:
             return
 
@@ -139,13 +175,16 @@ class Projects():
         return the dict'''
 
         siteinfo = self.get_siteinfo()
+        # checked once for every site there is
+        if todo:
+            todo = frozenset(todo)
 
         active_projects = {}
-        for sitegroup in siteinfo['sitematrix']:
+        for sitegroup, sites in siteinfo['sitematrix'].items():
             if sitegroup == 'specials':
-                self.process_special_sites(siteinfo['sitematrix'][sitegroup], active_projects, todo)
+                self.process_special_sites(sites, active_projects, todo)
             else:
-                self.process_regular_site(siteinfo['sitematrix'][sitegroup], active_projects, todo)
+                self.process_regular_site(sites, active_projects, todo)
         return active_projects
 
     def fill_in_projecttypes(self):
@@ -156,35 +195,28 @@ class Projects():
         '''
         siteinfo = self.get_siteinfo()
 
-        sess = requests.Session()
-        sess.headers.update(
-            {"User-Agent": self.config['agent'], "Accept": "application/json"})
-        getter = WebGetter(self.config, dryrun=self.dryrun)
-
-        for sitegroup in siteinfo['sitematrix']:
-            if sitegroup == 'specials':
-                for site in siteinfo['sitematrix'][sitegroup]:
-                    if site['dbname'] not in self.active:
-                        continue
-                    self.active[site['dbname']]['projecttype'] = self.get_projecttype_from_api(
-                        site['url'], getter, sess, site['dbname'])
-                    # this is us being nice to the remote servers yet again
-                    time.sleep(self.config['http_wait'])
+        # only the specials can be missing a project type
+        for site in siteinfo['sitematrix'].get('specials', []):
+            project = self.active.get(site['dbname'])
+            # todo projects got theirs already
+            if project is None or project.get('projecttype'):
+                continue
+            project['projecttype'] = self.get_projecttype_from_api(
+                site['url'], self.getter, self.api_session, site['dbname'])
+            # this is us being nice to the remote servers yet again
+            time.sleep(self.config['http_wait'])
 
         # great, we got that. now redo self.projecttypes_langcodes_to_dbnames
+        # and toss anything we cached from the old entries
+        self.projecttypes_langcodes_cache = {}
         self.projecttypes_langcodes_to_dbnames = self.get_active_projects_by_projecttype_langcode()
 
     def get_active_projects_by_projecttype_langcode(self):
         '''convert the active projects dict into one that uses the projecttype and langcode
         for a key and spits out the dbname (projectname) instead
         ome of these entries will not have a projecttype, just return empty for those'''
-        to_return = {}
-        for dbname in self.active:
-            if 'projecttype' in self.active[dbname]:
-                projecttype = self.active[dbname]['projecttype']
-                langcode = self.active[dbname]['langcode']
-                to_return[projecttype + '/' + langcode] = dbname
-        return to_return
+        return {(project['projecttype'], project['langcode']): dbname
+                for dbname, project in self.active.items() if 'projecttype' in project}
 
     def get_projectname_from_type_langcode(self, projecttype, langcode):
         '''given the project type and the so-called langcode, return
@@ -192,7 +224,7 @@ class Projects():
         if it does not, return projectype/langcode (caller should use the embedded /
         as an indicator that the project is not known any longer on the remote side)'''
         try:
-            return self.projecttypes_langcodes_to_dbnames[projecttype + '/' + langcode]
+            return self.projecttypes_langcodes_to_dbnames[(projecttype, langcode)]
         except KeyError:
             return projecttype + '/' + langcode
 
@@ -203,7 +235,10 @@ class Projects():
         enwiki -> wikipedia, en
         commonswiki -> wikipedia, commons
         If we were passed a dbname but the dbname is not in the dict of active
-        projects, then request the information via the mediawiki api'''
+        projects, then request the information via the mediawiki api
+        results are cached since callers ask about the same projects over and over'''
+        if project in self.projecttypes_langcodes_cache:
+            return self.projecttypes_langcodes_cache[project]
         if '/' in project:
             projecttype, langcode = project.split('/')
         elif project in self.active:
@@ -212,6 +247,7 @@ class Projects():
         else:
             # FROMHERE
             pass
+        self.projecttypes_langcodes_cache[project] = (projecttype, langcode)
         return (projecttype, langcode)
 
     def get_todos(self):
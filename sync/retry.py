@@ -0,0 +1,10 @@
+#!/usr/bin/python3
+from urllib3.util.retry import Retry
+
+
+class WaitingRetry(Retry):
+    '''urllib3 retries the first failure right away and only then starts
+    backing off; we want to give the server a breather every time, so
+    never wait less than the backoff factor between tries'''
+    def get_backoff_time(self):
+        return max(super().get_backoff_time(), self.backoff_factor)
@@ -2,12 +2,22 @@
 import os
 import gzip
 import hashlib
+import itertools
+import re
 import shutil
 import time
-import urllib
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+try:
+    # parallel decompression for big lists, if available
+    import rapidgzip
+except ImportError:
+    rapidgzip = None
 from sync.webgetter import WebGetter
 from sync.listsmaker import ListsMaker
+from sync.indexedlist import IndexedList
 from sync.local import LocalFiles
+from sync.logwriter import LogWriter
 
 
 class Sync():
@@ -18,6 +28,15 @@ class Sync():
             'odg', 'odp', 'ods', 'odt', 'ogg', 'ogv', 'omniplan', 'otf', 'ott',
             'pdf', 'png', 'ppd', 'ppt', 'psd', 'stl', 'svg',
             'wff2', 'webp', 'wmv', 'woff', 'xcf', 'xml', 'zip']
+    # for checking raw (bytes) filenames without decoding them
+    DOTTED_EXTS = tuple(b'.' + ext.encode('utf-8') for ext in EXTS)
+    PATH_SEP = os.path.sep.encode('utf-8')
+    # filenames made up only of these need no quoting in urls
+    URL_SAFE_FILENAME = re.compile(r'[A-Za-z0-9_.~-]+')
+    READ_BLOCKSIZE = 1024 * 1024
+    # below this size (compressed) it's not worth firing up parallel decompression
+    PARALLEL_GUNZIP_MINSIZE = 100 * 1024 * 1024
+    LOG_COMPRESSLEVEL = 1
 
     @staticmethod
     def is_sane_mediafilename(filename):
@@ -25,16 +44,10 @@ class Sync():
         in the global image links table but using it in a gallery, let's
         filter out the obvious cruft, make sure that the file has a known
         good extension, etc.'''
-        good = False
-        to_check = filename.decode('utf-8')
-        if '/' in to_check or os.path.sep in to_check:
+        if b'/' in filename or Sync.PATH_SEP in filename:
             # fast fail
             return False
-        for ext in Sync.EXTS:
-            if to_check.endswith('.' + ext):
-                good = True
-                break
-        if not good:
+        if not filename.endswith(Sync.DOTTED_EXTS):
             # no good ext
             return False
         # FIXME more sanity checks?
@@ -44,42 +57,92 @@ class Sync():
     def get_hashpath(filename, depth):
         '''given a filename get the hashpath (x/yy(/zzz, etc)) for media storage
         for mediawiki hashes 'depth' directories deep'''
-        summer = hashlib.md5()
-        summer.update(filename)
-        md5_hash = summer.hexdigest()
-        path = ''
-        for i in range(1, depth+1):
-            path = path + md5_hash[0:i] + '/'
-        return path.rstrip('/')
+        md5_hash = hashlib.md5(filename).hexdigest()
+        if depth == 2:
+            # what everyone uses, skip the loop
+            return md5_hash[0] + '/' + md5_hash[0:2]
+        return '/'.join(md5_hash[0:i] for i in range(1, depth+1))
 
     @staticmethod
     def get_last_entry(path):
         '''read and return the last entry from a
         gzipped file. expect the format to be
         'something'<whitespace>something else
-        Pretty awful isn't it'''
-        last_entry = None
-        with gzip.open(path, "rb") as infile:
+        if the file has an index we only read its last gzip member,
+        otherwise we read the whole thing, in big blocks, hanging on
+        only to the tail end of the last one
+        big unindexed files are decompressed in parallel if rapidgzip is installed'''
+        tail = b''
+        if os.path.exists(IndexedList.get_index_path(path)):
+            opener = IndexedList.open_last_member(path)
+        elif rapidgzip is not None and os.path.getsize(path) >= Sync.PARALLEL_GUNZIP_MINSIZE:
+            opener = rapidgzip.open(path, parallelization=os.cpu_count())
+        else:
+            opener = gzip.open(path, "rb")
+        with opener as infile:
             while True:
-                entry = infile.readline()
-                if not entry:
-                    return last_entry
-                last_entry = entry.rstrip().split()[0]
-                if last_entry.startswith(b"'") and last_entry.endswith(b"'"):
-                    last_entry = last_entry[1:-1]
-        return None
+                block = infile.read(Sync.READ_BLOCKSIZE)
+                if not block:
+                    break
+                tail = tail + block
+                # keep only the last non-empty line (plus whatever trails it)
+                tail = tail[tail.rfind(b'\n', 0, len(tail.rstrip())) + 1:]
+        if not tail.strip():
+            return None
+        last_entry = tail.split()[0]
+        if last_entry.startswith(b"'") and last_entry.endswith(b"'"):
+            last_entry = last_entry[1:-1]
+        return last_entry
 
     @staticmethod
     def find_entry_in_file(fhandle, to_find):
-        '''find the last entry in a gzipped file
-        and return it. the slow tedious way.'''
+        '''find the given entry in a gzipped file, leaving the file
+        positioned just after it, and return True, or False if
+        it's not there. we look at whatever is buffered a block at
+        a time instead of reading line by line'''
+        needle = b'\n' + to_find + b'\n'
         while True:
-            entry = fhandle.readline()
-            if not entry:
+            block = fhandle.peek(Sync.READ_BLOCKSIZE)
+            if not block:
                 return False
-            entry = entry.rstrip()
-            if entry == to_find:
+            end = block.rfind(b'\n') + 1
+            if not end:
+                # no complete line buffered, do it the slow way
+                if fhandle.readline().rstrip() == to_find:
+                    return True
+                continue
+            # we are always at the start of a line here
+            index = (b'\n' + block[:end]).find(needle)
+            if index != -1:
+                fhandle.read(index + len(needle) - 1)
                 return True
+            fhandle.read(end)
+
+    @staticmethod
+    def open_log(path, mode):
+        '''open a gzipped download log for writing or appending and return
+        the file handle. these logs are rarely read, so don't work hard at
+        compressing, and write them with an index so that the last entry
+        can be found cheaply (see get_last_entry)'''
+        return IndexedList(path, mode, compresslevel=Sync.LOG_COMPRESSLEVEL)
+
+    @staticmethod
+    def read_entries(fhandle):
+        '''read a gzipped file of entries, one per line, of the format
+        filename<whitespace>maybe other stuff, a block at a time
+        and yield the list of filenames for each block, skipping
+        blank lines'''
+        leftover = b''
+        while True:
+            block = fhandle.read(Sync.READ_BLOCKSIZE)
+            if not block:
+                break
+            lines = (leftover + block).split(b'\n')
+            # last one may be incomplete, save it for next time
+            leftover = lines.pop()
+            yield [line.split(None, 1)[0] for line in lines if line.strip()]
+        if leftover.strip():
+            yield [leftover.split(None, 1)[0]]
 
     def __init__(self, config, projects, today, most_recent_lists,
                  full=False, verbose=False, dryrun=False):
@@ -96,6 +159,8 @@ class Sync():
         self.most_recent_lists = most_recent_lists
         self.verbose = verbose
         self.dryrun = dryrun
+        # one for everything, so that connections to the server get reused
+        self.getter = WebGetter(self.config, self.dryrun)
 
     def delete_local_media_not_on_remote(self):
         '''for each project todo, 'delete' all media not on the remote
@@ -108,6 +173,9 @@ class Sync():
         around
         folks who want to permanently remove such images can
         periodically clean out the archive/deleted directory'''
+        # a plain rename will do, unless the archive is on some other filesystem
+        same_fs = (os.stat(self.config['mediadir']).st_dev ==
+                   os.stat(self.config['archivedir']).st_dev)
         todos = self.projects.get_todos()
         for project in todos:
             basedir = os.path.join(self.config['listsdir'], self.today, project)
@@ -118,54 +186,66 @@ class Sync():
                 # this is the incremental list
                 deletes_list = os.path.join(basedir, project + '-all-media-gone.gz')
             (projecttype, langcode) = self.projects.get_projecttype_langcode(project)
+            project_dir = os.path.join(self.config['mediadir'], projecttype, langcode)
             archived_deletes_dir = os.path.join(self.config['archivedir'], 'deleted',
                                                 projecttype, langcode)
             if self.dryrun:
                 print("would move entries in {deletes} to {archived} ".format(
                     deletes=deletes_list, archived=archived_deletes_dir))
-                return
-            if not os.path.exists(archived_deletes_dir):
-                os.makedirs(archived_deletes_dir)
-                LocalFiles.init_hashdirs(archived_deletes_dir, self.dryrun)
+                continue
+            # make sure the hashdirs are all there even if the project dir
+            # already was, so we don't fail partway through the moves
+            os.makedirs(archived_deletes_dir, exist_ok=True)
+            LocalFiles.init_hashdirs(archived_deletes_dir, self.dryrun)
             if self.verbose:
                 print("moving entries in {deletes} to {archived} ".format(
                     deletes=deletes_list, archived=archived_deletes_dir))
             with gzip.open(deletes_list, "rb") as deletes:
-                while True:
-                    delete_line = deletes.readline()
-                    if not delete_line:
-                        # eof
-                        return
-                    filename = delete_line.rstrip().split()[0]
-                    hashpath = self.get_hashpath(filename, 2)
-                    old_path = os.path.join(self.config['mediadir'], projecttype, langcode,
-                                            hashpath, filename.decode('utf-8'))
-                    new_path = os.path.join(archived_deletes_dir,
-                                            hashpath, filename.decode('utf-8'))
-                    shutil.move(old_path, new_path)
-
-    def get_media_download_url(self, file_toget, project, hashpath, upload_type):
-        '''get and return the url for downloading the original media
+                for filenames in self.read_entries(deletes):
+                    for filename in filenames:
+                        hashpath = self.get_hashpath(filename, 2)
+                        filename = filename.decode('utf-8')
+                        old_path = os.path.join(project_dir, hashpath, filename)
+                        new_path = os.path.join(archived_deletes_dir, hashpath, filename)
+                        try:
+                            if same_fs:
+                                os.replace(old_path, new_path)
+                            else:
+                                shutil.move(old_path, new_path)
+                        except FileNotFoundError:
+                            # already gone, nothing to do; but if it's still
+                            # there, it's the destination that's missing
+                            if os.path.exists(old_path):
+                                raise
+                            continue
+
+    def get_project_media_url(self, projecttype, langcode, upload_type):
+        '''get and return the base url for downloading original media
+        for a project, to which the hashdirs and filename get appended
         upload_type is local or foreignrepo'''
-        # https://upload.wikimedia.org/projecttype/langcode/hash/dir/filename
-
-        # deal with silly things like % and other fun characters in the url
-        encoded_toget = urllib.parse.quote(file_toget.decode('utf-8'))
-
+        # https://upload.wikimedia.org/projecttype/langcode
         if upload_type == 'local':
-            (projecttype, langcode) = self.projects.get_projecttype_langcode(project)
-            projecturl = '{baseurl}/{ptype}/{lcode}'.format(
+            return '{baseurl}/{ptype}/{lcode}'.format(
                 baseurl=self.config['uploaded_media_url'],
                 ptype=projecttype, lcode=langcode)
-        elif upload_type == 'foreignrepo':
-            projecturl = self.config['foreignrepo_media_url']
-        else:
-            # we have no idea what the caller wants
-            return None
+        if upload_type == 'foreignrepo':
+            return self.config['foreignrepo_media_url']
+        # we have no idea what the caller wants
+        return None
 
-        url = '{projecturl}/{hashdirs}/{toget}'.format(
-            projecturl=projecturl, hashdirs=hashpath, toget=encoded_toget)
-        return url
+    def quote_filename(self, filename):
+        '''deal with silly things like % and other fun characters in the
+        (decoded) filename, returning something usable in a url'''
+        if self.URL_SAFE_FILENAME.fullmatch(filename):
+            return filename
+        return urllib.parse.quote(filename)
+
+    def get_media_download_url(self, projecturl, hashpath, file_toget):
+        '''get and return the url for downloading the original media, given
+        the base url for the project from get_project_media_url
+        file_toget is the (decoded) filename'''
+        # https://upload.wikimedia.org/projecttype/langcode/hash/dir/filename
+        return projecturl + '/' + hashpath + '/' + self.quote_filename(file_toget)
 
     def get_new_media_for_project(self, repotype, project, maxgets, fhandles):
         '''
@@ -173,49 +253,75 @@ class Sync():
         file handles to where to log successful retrievals
         and failures, get all the files, logging the results,
         storing them appropriately
+        up to http_workers files are downloaded at once; each such batch
+        takes at least http_wait seconds per file, counting from its start,
+        so that the overall request rate stays at one per http_wait seconds
         '''
-        getter = WebGetter(self.config, self.dryrun)
         (projecttype, langcode) = self.projects.get_projecttype_langcode(project)
         download_basedir = os.path.join(self.config['mediadir'], projecttype, langcode)
+        projecturl = self.get_project_media_url(projecttype, langcode, repotype)
+        if projecturl is None:
+            return
+        workers = max(self.config['http_workers'], 1)
+        wait = self.config['http_wait']
+        # in case we have a file with filename<whitespace>timestamp<stuff> in it,
+        # read_entries gives us just the filenames
+        togets = (toget for filenames in self.read_entries(fhandles['toget_in'])
+                  for toget in filenames if self.is_sane_mediafilename(toget))
         gets = 0
-        while gets < maxgets:
-            gets += 1
-
-            toget = fhandles['toget_in'].readline()
-            if not toget:
-                # end of file
-                return
-            toget = toget.rstrip()
-            # in case we have a file with filename<whitespace>timestamp<stuff> in it.
-            toget = toget.split()[0]
-            if not self.is_sane_mediafilename(toget):
-                continue
+        # log entries are written out from separate threads so compression
+        # doesn't hold up the downloads
+        with LogWriter(fhandles['retr_out']) as retr_out, \
+                LogWriter(fhandles['fail_out']) as fail_out:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                while gets < maxgets:
+                    batch = list(itertools.islice(togets, min(workers, maxgets - gets)))
+                    if not batch:
+                        # end of file
+                        return
 
-            hashpath = self.get_hashpath(toget, 2)
-            url = self.get_media_download_url(toget, project, hashpath, repotype)
-
-            resp_code = getter.get_file(url,
-                                        os.path.join(download_basedir, hashpath,
-                                                     toget.decode('utf-8')),
-                                        'failed to download media on ' + project + ' via ' + url,
-                                        return_on_fail=True)
-            if resp_code:
-                fhandles['fail_out'].write(("'%s' [%d] %s\n" % (
-                    toget.decode('utf-8'), resp_code, url)).encode('utf-8'))
-
-                fhandles['fail_out'].write("'{filename}' [{code}] {url}\n".format(
-                    filename=toget, url=url, code=resp_code).encode('utf-8'))
-                if resp_code == 404:
-                    # don't count missing files against our get count, they are
-                    # probably junk links
-                    gets -= 1
-            else:
-                fhandles['retr_out'].write(("'%s' %s\n" % (
-                    toget.decode('utf-8'), url)).encode('utf-8'))
-            time.sleep(self.config['http_wait'])
+                    batch_started = time.monotonic()
+                    downloads = []
+                    for toget in batch:
+                        hashpath = self.get_hashpath(toget, 2)
+                        toget = toget.decode('utf-8')
+                        url = self.get_media_download_url(projecturl, hashpath, toget)
+                        future = executor.submit(
+                            self.getter.get_file, url,
+                            os.path.join(download_basedir, hashpath, toget),
+                            'failed to download media on ' + project + ' via ' + url,
+                            return_on_fail=True)
+                        downloads.append((toget, url, future))
+
+                    for toget, url, future in downloads:
+                        resp_code = future.result()
+                        if resp_code:
+                            fail_out.write(("'%s' [%d] %s\n" % (
+                                toget, resp_code, url)).encode('utf-8'))
+                            # don't count missing files against our get count, they are
+                            # probably junk links
+                            if resp_code != 404:
+                                gets += 1
+                        else:
+                            gets += 1
+                            retr_out.write(("'%s' %s\n" % (toget, url)).encode('utf-8'))
+                    # the time spent downloading counts towards the wait
+                    time.sleep(max(0, batch_started + wait * len(downloads) - time.monotonic()))
+
+    def get_new_media_with_logs(self, toget_in, repotype, project, maxgets, files, mode="wb"):
+        '''
+        given file handle to list of files to retrieve, and a dict with
+        paths to the logs for retrieved and failed files, open the logs,
+        either fresh (mode "wb") or adding on to what's there (mode "ab"),
+        and get the files
+        '''
+        fhandles = {'toget_in': toget_in}
+        with self.open_log(files['retrieved'], mode) as fhandles['retr_out']:
+            with self.open_log(files['failed'], mode) as fhandles['fail_out']:
+                self.get_new_media_for_project(repotype, project, maxgets, fhandles)
 
-    def get_new_media_from_list(self, max_gets, repotype, files):
-        '''for each project todo, get uploaded media that
+    def get_new_media_from_list(self, max_gets, repotype, project, files):
+        '''for the given project, get uploaded media that
         we don't have locally, up to some number (configured)
         of items
         write all entries we retrieved to
@@ -226,17 +332,12 @@ class Sync():
         do only so many at a time, before the next deletion run,
         in case there's been a long gap between runs and you're
         playing catch-up.'''
-        fhandles = {}
-        todos = self.projects.get_todos()
-        for project in todos:
-            if self.dryrun:
-                print("would get files from {flist}, logs {failed} (failed), {ok} (ok)".format(
-                    flist=files['toget'], failed=files['failed'], ok=files['retrieved']))
-                return
-            with gzip.open(files['toget'], "rb") as fhandles['toget_in']:
-                with gzip.open(files['retrieved'], "wb") as fhandles['retr_out']:
-                    with gzip.open(files['failed'], "wb") as fhandles['fail_out']:
-                        self.get_new_media_for_project(repotype, project, max_gets, fhandles)
+        if self.dryrun:
+            print("would get files from {flist}, logs {failed} (failed), {ok} (ok)".format(
+                flist=files['toget'], failed=files['failed'], ok=files['retrieved']))
+            return
+        with gzip.open(files['toget'], "rb") as toget_in:
+            self.get_new_media_with_logs(toget_in, repotype, project, max_gets, files)
 
     def get_new_media(self):
         '''
@@ -251,32 +352,33 @@ class Sync():
         files = {}
         todos = self.projects.get_todos()
         for project in todos:
+            # no previous list of media to keep means we can't do an incremental run
+            use_full = self.full or not ListsMaker.get_most_recent_file(
+                project, '-all-media-keep.gz', self.most_recent_lists)
             files['retrieved'] = os.path.join(basedir, self.today, project,
                                               project + '-local-retrieved.gz')
             files['failed'] = os.path.join(basedir, self.today, project,
                                            project + '-local-get-failed.gz')
-            if self.full or not ListsMaker.get_most_recent_file(
-                    project, '-all-media-keep.gz', self.most_recent_lists):
+            if use_full:
                 files['toget'] = os.path.join(basedir, self.today, project,
                                               project + '-uploaded-toget.gz')
             else:
                 # this is the incremental file
                 files['toget'] = os.path.join(basedir, self.today, project,
                                               project + '-new-media-projectuploads.gz')
-            self.get_new_media_from_list(max_local_gets, 'local', files)
+            self.get_new_media_from_list(max_local_gets, 'local', project, files)
             files['retrieved'] = os.path.join(basedir, self.today, project,
                                               project + '-foreignrepo-retrieved.gz')
             files['failed'] = os.path.join(basedir, self.today, project,
                                            project + '-foreignrepo-get-failed.gz')
-            if self.full or not ListsMaker.get_most_recent_file(
-                    project, '-all-media-keep.gz', self.most_recent_lists):
+            if use_full:
                 files['toget'] = os.path.join(basedir, self.today, project,
                                               project + '-foreignrepo-toget.gz')
             else:
                 # this is the incremental file
                 files['toget'] = os.path.join(basedir, self.today, project,
-                                              project + 'new-media-foreignrepouploads.gz')
-            self.get_new_media_from_list(max_foreignrepo_gets, 'foreignrepo', files)
+                                              project + '-new-media-foreignrepouploads.gz')
+            self.get_new_media_from_list(max_foreignrepo_gets, 'foreignrepo', project, files)
 
     def get_fnames_for_continue(self, upload_type, date, project):
         '''
@@ -298,52 +400,55 @@ class Sync():
             # no idea what the upload type is
             return fnames
 
-        fnames['to_get_list'] = os.path.join(
+        fnames['toget'] = os.path.join(
             basedir, date, project, project + '-{ftype}-toget.gz'.format(
                 ftype=toget_type))
-        fnames['retrieved_list'] = os.path.join(
+        fnames['retrieved'] = os.path.join(
             basedir, date, project, project + '-{ftype}-retrieved.gz'.format(
                 ftype=retrieved_type))
-        fnames['failed_list'] = os.path.join(
+        fnames['failed'] = os.path.join(
             basedir, date, project, project + '-{ftype}-get-failed.gz'.format(
                 ftype=retrieved_type))
         return fnames
 
-    def continue_uploaded_media_gets(self, project, downloaded_last, fnames):
+    def continue_media_gets(self, project, upload_type, lists_by_date):
         '''
-        given the project, a dict of input and output files, and the date
-        of the last download, continue getting media from the input list
-        and log results to the success and fail output files.
+        for the given project and upload type (project-uploaded: 'local', or
+        foreignrepo-uploaded: 'foreign'), find the last file we tried to download,
+        locate it in the list of files to download from that date, and continue
+        getting media from there, adding results to the retrieved and failed logs
+        for that date.
         '''
-        fhandles = {}
+        downloaded_last, gets_date = self.get_downloaded_last(project, upload_type, lists_by_date)
+        if downloaded_last is None:
+            downloaded_last, gets_date = self.get_downloaded_last(project, upload_type,
+                                                                  lists_by_date, failed=True)
         if downloaded_last is None:
             return
 
-        with gzip.open(fnames['to_get_list'], "rb") as fhandles['toget_in']:
-            if not self.find_entry_in_file(fhandles['toget_in'], downloaded_last):
+        fnames = self.get_fnames_for_continue(upload_type, gets_date, project)
+        if upload_type == 'local':
+            repotype = 'local'
+            maxgets = self.config['max_uploaded_gets']
+        else:
+            repotype = 'foreignrepo'
+            maxgets = self.config['max_foreignrepo_gets']
+
+        # the list is sorted so we can skip ahead to near the entry we want
+        with IndexedList.open_near(fnames['toget'], downloaded_last) as toget_in:
+            if not self.find_entry_in_file(toget_in, downloaded_last):
                 return
             if self.dryrun:
                 print("would download media after", downloaded_last, "from",
-                      fnames['to_get_list'], 'with logging to', fnames['retrieved_list'],
-                      "and", fnames['failed_list'])
+                      fnames['toget'], 'with logging to', fnames['retrieved'],
+                      "and", fnames['failed'])
                 return
             if self.verbose:
                 print("downloading media after", downloaded_last, "from",
-                      fnames['to_get_list'], ' with logging to', fnames['retrieved_list'],
-                      "and", fnames['failed_list'])
-
-            retr_mode = "wb"
-            if os.path.exists(fnames['retrieved_list']):
-                retr_mode = "ab"
+                      fnames['toget'], ' with logging to', fnames['retrieved'],
+                      "and", fnames['failed'])
 
-            failed_mode = "wb"
-            if os.path.exists(fnames['failed_list']):
-                failed_mode = "ab"
-
-            with gzip.open(fnames['retrieved_list'], retr_mode) as fhandles['retr_out']:
-                with gzip.open(fnames['failed_list'], failed_mode) as fhandles['fail_out']:
-                    self.get_new_media_for_project(
-                        'local', project, self.config['max_uploaded_gets'], fhandles)
+            self.get_new_media_with_logs(toget_in, repotype, project, maxgets, fnames, mode="ab")
 
     def get_downloaded_last(self, project, upload_type, lists_by_date, failed=False):
         '''
@@ -384,32 +489,16 @@ class Sync():
         for each project todo, find the last file we successfully downloaded for
         project-uploaded media, check the list of files to download for that date,
         locate the entry in that file with the last file we downloaded, and continue
-        downloads from there. Then repeat for foreign-repo-uploaded media (yet to be
-        implemented). Log all downloads to success/failure logs for today.
+        downloads from there. Then repeat for foreign-repo-uploaded media.
+        Log all downloads to the success/failure logs for the date of the list.
         We only look at full lists to download, not incremental lists (this needs
         also to be implemented, but with care).
         '''
-        lists_by_date = ListsMaker.get_most_recent(self.config['listsdir'], today=True)
+        lists_by_date = ListsMaker.get_most_recent(self.config['listsdir'], self.today,
+                                                   do_today=True)
 
         todos = self.projects.get_todos()
         for project in todos:
-
-            # project-uploaded files first
-            downloaded_last, gets_date = self.get_downloaded_last(project, 'local', lists_by_date)
-            if downloaded_last is None:
-                downloaded_last, gets_date = self.get_downloaded_last(project, 'local',
-                                                                      lists_by_date, failed=True)
-
-            if downloaded_last is not None:
-                fnames = self.get_fnames_for_continue('local', gets_date, project)
-                self.continue_uploaded_media_gets(project, downloaded_last, fnames)
-
-            # foreignrepo-uploaded files next
-            downloaded_last, gets_date = self.get_downloaded_last(project, 'foreign', lists_by_date)
-            if downloaded_last is None:
-                downloaded_last, gets_date = self.get_downloaded_last(project, 'foreign',
-                                                                      lists_by_date, failed=True)
-
-            if downloaded_last is not None:
-                fnames = self.get_fnames_for_continue('foreign', gets_date, project)
-                self.continue_uploaded_media_gets(project, downloaded_last, fnames)
+            # project-uploaded files first, then foreignrepo-uploaded files
+            self.continue_media_gets(project, 'local', lists_by_date)
+            self.continue_media_gets(project, 'foreign', lists_by_date)
@@ -1,31 +1,56 @@
 #!/usr/bin/python3
-import shutil
 import sys
-import time
 import requests
+from requests.adapters import HTTPAdapter
+from sync.retry import WaitingRetry
 
 
 class WebGetter():
     '''methods for getting content over http(s) and
 possibly storing it some nice place, with retries'''
+    CHUNKSIZE = 1024 * 1024
+    # these may go away if we try again; anything else (404 for example) won't
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
     def __init__(self, config, dryrun):
         self.config = config
         self.dryrun = dryrun
+        # one session for all our requests, so connections get reused;
+        # make sure the pool is big enough for concurrent downloads
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": self.config['agent']})
+        self.adapter = self.get_adapter()
+        self.mount_adapter(self.session)
+
+    def get_adapter(self):
+        '''return an http adapter that retries failed requests for us, up to
+        http_retries tries in all, waiting http_wait seconds before the first
+        retry and twice as long before each one after that, and with a
+        connection pool big enough for concurrent downloads'''
+        # when we're out of retries, hand back the last response so that
+        # callers can look at its status code
+        retries = WaitingRetry(total=max(self.config['http_retries'] - 1, 0),
+                               backoff_factor=self.config['http_wait'],
+                               status_forcelist=self.RETRY_STATUSES,
+                               allowed_methods=('GET', 'HEAD'), raise_on_status=False)
+        poolsize = max(self.config.get('http_workers', 1), 1)
+        return HTTPAdapter(max_retries=retries, pool_connections=poolsize,
+                           pool_maxsize=poolsize)
+
+    def mount_adapter(self, session):
+        '''have the session use our retrying adapter for all requests;
+        callers passing in their own session to get_content should do
+        this once when they create it'''
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
 
     def get_file(self, url, localpath, err_message, return_on_fail=False):
         '''retrieve a file and put it in the right place,
         with retries and wait between retries as needed'''
-        headers = {"User-Agent": self.config['agent']}
-        retried = 0
-        done = False
-        while not done and retried < self.config['http_retries']:
-            response = requests.get(url, timeout=5, stream=True, headers=headers)
-            if response.status_code == 200:
-                done = True
-            else:
-                retried += 1
-                time.sleep(self.config['http_wait'])
-        if not done:
+        response = self.session.get(url, timeout=5, stream=True)
+        if response.status_code != 200:
+            # give the connection back to the pool
+            response.close()
             sys.stderr.write(err_message + ' (response code: {code})\n'.format(
                 code=response.status_code))
             if return_on_fail:
@@ -34,26 +59,21 @@ possibly storing it some nice place, with retries'''
 
         if self.dryrun:
             print("would save output from", url, "to", localpath)
+            response.close()
             return 200
-        with open(localpath, 'wb') as output:
-            shutil.copyfileobj(response.raw, output)
+        # big chunks, written straight out, mean fewer syscalls. we want the
+        # bytes exactly as served: a .gz list sent with Content-Encoding: gzip
+        # must not get unpacked on the way into a file that's still called .gz
+        with response, open(localpath, 'wb', buffering=0) as output:
+            for chunk in response.raw.stream(self.CHUNKSIZE, decode_content=False):
+                output.write(chunk)
 
     def get_content(self, url, err_message, params=None, session=None):
         '''retrieve content of a url, with retries'''
         if not session:
-            session = requests.Session()
-        session.headers.update(
-            {"User-Agent": self.config['agent']})
-        retried = 0
-        done = False
-        while not done and retried < self.config['http_retries']:
-            response = session.get(url, timeout=5, params=params)
-            if response.status_code == 200:
-                done = True
-            else:
-                retried += 1
-                time.sleep(self.config['http_wait'])
-        if not done:
+            session = self.session
+        response = session.get(url, timeout=5, params=params)
+        if response.status_code != 200:
             sys.stderr.write(err_message +
                              ' (response code: {code}\n'.format(code=response.status_code))
             response.raise_for_status()
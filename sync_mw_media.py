@@ -2,9 +2,10 @@
 import configparser
 import getopt
 import os
-import urllib
+import urllib.parse
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from sync.projects import Projects
 from sync.local import LocalFiles
 from sync.listsmaker import ListsMaker
@@ -15,10 +16,13 @@ from sync.sync import Sync
 CONFIG_SECTIONS = {'dirs': ['mediadir', 'archivedir', 'listsdir'],
                    'urls': ['api_url', 'media_filelists_url', 'uploaded_media_url',
                             'foreignrepo_media_url'],
-                   'limits': ['http_wait', 'http_retries', 'max_uploaded_gets',
-                              'max_foreignrepo_gets'],
+                   'limits': ['http_wait', 'http_retries', 'http_workers', 'max_uploaded_gets',
+                              'max_foreignrepo_gets', 'local_workers'],
                    'misc': ['api_path', 'foreignrepo', 'agent']}
 
+# settings that may be left out of the config file
+CONFIG_DEFAULTS = {'http_workers': '1', 'local_workers': '1'}
+
 
 def usage(message=None):
     '''
@@ -28,7 +32,7 @@ def usage(message=None):
     if message:
         sys.stderr.write("%s\n" % message)
     usage_message = """Usage: $0 --configfile <path> [--projects] [--retries <num>]
-          [--wait <num>] [--continue] [--verbose] [--dryrun]
+          [--wait <num>] [--continue] [--refresh-sitematrix] [--verbose] [--dryrun]
 or: $0 --help
 
 This script retrieves information about media files uploaded or in use on a group of wikis,
@@ -54,6 +58,8 @@ Arguments:
                          value in the config file
     --wait       (-w)    the number of seconds to wait between downloads; if set here,
                          this will override any value in the config file
+    --refresh-sitematrix get the list of active projects from the MediaWiki api even if
+                         a copy saved in the lists directory in the past day is available
     --verbose    (-v)    display various progress messages as the script runs
     --dryrun     (-d)    don't create or delete any files, show what would have been done
 """
@@ -84,6 +90,8 @@ def get_flag(opt, args):
         args['continue'] = True
     elif opt in ["-f", "--full"]:
         args['full'] = True
+    elif opt == "--refresh-sitematrix":
+        args['refresh_sitematrix'] = True
     elif opt in ["-v", "--verbose"]:
         args['verbose'] = True
     elif opt in ["-d", "--dryrun"]:
@@ -104,14 +112,16 @@ def parse_args():
             'archive': False,
             'continue': False,
             'full': False,
+            'refresh_sitematrix': False,
             'configfile': None,
             'projects_todo': None,
             'retries': None,
             'wait': None}
     try:
         (options, remainder) = getopt.gnu_getopt(
-            sys.argv[1:], "c:p:r:w:aCdvh", ["configfile=", "retries=", "wait=", "projects=",
+            sys.argv[1:], "c:p:r:w:aCfdvh", ["configfile=", "retries=", "wait=", "projects=",
                                             "archive", "continue", "full",
+                                            "refresh-sitematrix",
                                             "verbose", "dryrun", "help"])
 
     except getopt.GetoptError as err:
@@ -137,11 +147,11 @@ def check_missing_args(args):
 def validate_args(args):
     '''validate arguments, whine about values
     as needed'''
-    if args['retries']:
+    if args['retries'] is not None:
         if not args['retries'].isdigit():
             usage('--retries argument must be a positive integer')
         args['retries'] = int(args['retries'])
-    if args['wait']:
+    if args['wait'] is not None:
         if not args['wait'].isdigit():
             usage('--wait argument must be a positive integer')
         args['wait'] = int(args['wait'])
@@ -159,8 +169,16 @@ def get_args():
 
 def get_config(configfile):
     '''read and parse config file entries'''
-    parser = configparser.ConfigParser()
-    parser.read(configfile)
+    # plain key=value settings; urls and user agents may well have a % in them,
+    # which interpolation would choke on
+    parser = configparser.ConfigParser(interpolation=None)
+    # parser.read() would quietly skip a file it can't open
+    try:
+        with open(configfile, 'r', encoding='utf-8') as infile:
+            parser.read_file(infile)
+    except OSError:
+        sys.stderr.write("Failed to read configuration file " + configfile + "\n")
+        raise
     for section in CONFIG_SECTIONS:
         if not parser.has_section(section):
             sys.stderr.write("The mandatory configuration section "
@@ -168,19 +186,22 @@ def get_config(configfile):
             raise configparser.NoSectionError(section)
 
     config = {}
-    for section in CONFIG_SECTIONS:
-        for setting in CONFIG_SECTIONS[section]:
+    for section, settings in CONFIG_SECTIONS.items():
+        for setting in settings:
             if parser.has_option(section, setting):
                 config[setting] = parser.get(section, setting)
+            elif setting in CONFIG_DEFAULTS:
+                config[setting] = CONFIG_DEFAULTS[setting]
     return config
 
 
 def validate_config(config):
     '''validate and convert config values'''
     for path in CONFIG_SECTIONS['dirs']:
-        if not os.path.exists(config[path]):
-            sys.stderr.write('No such path {path} for setting {setting}\n'.format(
-                path=path, setting=config[path]))
+        # one stat each, same as exists(), but a stray file won't pass
+        if not os.path.isdir(config[path]):
+            sys.stderr.write('No such directory {path} for setting {setting}\n'.format(
+                path=config[path], setting=path))
             raise ValueError('Bad configfile setting')
 
     for url in CONFIG_SECTIONS['urls']:
@@ -200,33 +221,24 @@ def validate_config(config):
     for setting in CONFIG_SECTIONS['misc']:
         if not config[setting]:
             sys.stderr.write('Setting {setting} cannot be empty\n'.format(
-                setting=config[setting]))
+                setting=setting))
             raise ValueError('Bad configfile setting')
 
 
 def merge_config(config, args):
     '''fold in any values from args that should be in the
     config settings, overriding settings from the configfile'''
-    if args['retries']:
+    if args['retries'] is not None:
         config['http_retries'] = args['retries']
-    if args['wait']:
-        config['http_wait'] = args['retries']
-
-
-def exclude_foreign_repo(config, active_projects):
-    '''toss the foreign repo from the list of active
-    projects. We won't mirror all that content!
-    For Wikimedia project mirroring, the foreign repo
-    would be commons.wikimedia.org (commonswiki).'''
-    if config['foreignrepo']:
-        if config['foreignrepo'] in active_projects:
-            active_projects.pop(config['foreignrepo'], None)
+    if args['wait'] is not None:
+        config['http_wait'] = args['wait']
 
 
 def do_continue_downloads(args, config, projects, today):
     '''continue to retrieve media from remote, picking up
     from where last run left off, if any.'''
-    syncer = Sync(config, projects, today, args['verbose'], args['dryrun'])
+    # continuing looks up the most recent lists for itself
+    syncer = Sync(config, projects, today, None, False, args['verbose'], args['dryrun'])
 
     if args['verbose']:
         print("continuing to download local media not on remote project")
@@ -329,20 +341,28 @@ def do_main():
     validate_config(config)
     merge_config(config, args)
 
-    projects = Projects(config, args['projects_todo'], args['dryrun'])
+    projects = Projects(config, args['projects_todo'], args['dryrun'],
+                        args['refresh_sitematrix'])
     if args['verbose']:
         print("active projects are:", ",".join(projects.active.keys()))
 
     today = time.strftime("%Y%m%d", time.gmtime())
-    most_recent_lists = ListsMaker.get_most_recent(config['listsdir'], today)
-    if args['verbose']:
-        print(most_recent_lists)
-
     if args['continue']:
+        # this looks over the lists itself, including today's
         do_continue_downloads(args, config, projects, today)
     else:
-        do_localmedia_prep(args, config, projects, today, most_recent_lists)
-        do_lists_retrieval(args, config, projects, today)
+        most_recent_lists = ListsMaker.get_most_recent(config['listsdir'], today)
+        if args['verbose']:
+            print(most_recent_lists)
+
+        # local media prep is mostly disk and lists retrieval mostly network,
+        # and neither needs anything from the other, so do them both at once
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            prep = executor.submit(do_localmedia_prep, args, config, projects, today,
+                                   most_recent_lists)
+            retrieval = executor.submit(do_lists_retrieval, args, config, projects, today)
+            prep.result()
+            retrieval.result()
         do_lists_generation(args, config, projects, today, most_recent_lists)
         do_sync(args, config, projects, today, most_recent_lists)
 